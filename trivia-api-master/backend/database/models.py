@@ -1,5 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, ForeignKey, Index, Integer, String
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import relationship
 
 database_name = 'trivia'
 database_path = f'postgresql://localhost:5432/{database_name}'
@@ -17,7 +19,25 @@ def setup_db(app, database_path=database_path):
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
     db.app = app
     db.init_app(app)
+    db.engine.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
     db.create_all()
+    # create_all skips tables that already exist, so databases seeded
+    # from trivia.psql need the model's indexes created explicitly
+    db.engine.execute(
+        'CREATE INDEX IF NOT EXISTS ix_questions_category_id '
+        'ON questions (category, id)')
+    db.engine.execute(
+        'CREATE INDEX IF NOT EXISTS ix_questions_question_trgm '
+        'ON questions USING gin (question gin_trgm_ops)')
+    # Databases created before the payload column existed need it added
+    # and backfilled; both statements are no-ops afterwards
+    db.engine.execute(
+        'ALTER TABLE questions ADD COLUMN IF NOT EXISTS payload JSONB')
+    db.engine.execute(
+        "UPDATE questions SET payload = jsonb_build_object("
+        "'id', id, 'question', question, 'answer', answer, "
+        "'category', category, 'difficulty', difficulty) "
+        "WHERE payload IS NULL")
 
 
 class Question(db.Model):
@@ -25,12 +45,25 @@ class Question(db.Model):
     Question
     """
     __tablename__ = 'questions'
+    __table_args__ = (
+        Index('ix_questions_category_id', 'category', 'id'),
+        Index('ix_questions_question_trgm', 'question',
+              postgresql_using='gin',
+              postgresql_ops={'question': 'gin_trgm_ops'}),
+    )
 
     id = Column(Integer, primary_key=True)
     question = Column(String)
     answer = Column(String)
-    category = Column(Integer)
+    category = Column(Integer, ForeignKey('categories.id'))
     difficulty = Column(Integer)
+    # Response dict computed once per write so list endpoints can read
+    # it straight off the row instead of rebuilding it per request
+    payload = Column(JSONB)
+    # format() only reads local columns; lazy='raise' turns any future
+    # per-row lazy load on list endpoints into an immediate error
+    # instead of a silent N+1
+    category_ref = relationship('Category', lazy='raise')
 
     def __init__(self, question, answer, category, difficulty):
         self.question = question
@@ -40,16 +73,21 @@ class Question(db.Model):
 
     def insert(self):
         db.session.add(self)
+        # The id is only assigned at flush time, so the payload snapshot
+        # is built afterwards
+        db.session.flush()
+        self.payload = self._build_payload()
         db.session.commit()
 
     def update(self):
+        self.payload = self._build_payload()
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
         db.session.commit()
 
-    def format(self):
+    def _build_payload(self):
         return {
             'id': self.id,
             'question': self.question,
@@ -58,6 +96,9 @@ class Question(db.Model):
             'difficulty': self.difficulty
         }
 
+    def format(self):
+        return self.payload or self._build_payload()
+
 
 class Category(db.Model):
     """
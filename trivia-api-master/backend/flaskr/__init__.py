@@ -1,14 +1,56 @@
-# import random
+import os
+import random
 import re
 
-from flask import abort, Flask, jsonify, request
+import orjson
+from flask import abort, current_app, Flask, request
+from flask_caching import Cache
 from flask_cors import CORS
 from werkzeug.exceptions import HTTPException
+from sqlalchemy import all_, bindparam, Integer, text
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.sql.expression import func
 
-from backend.database.models import Category, Question, setup_db
+from backend.database.models import db, Question, setup_db
 
 QUESTIONS_PER_PAGE = 10
+# Below this length trigram selectivity degrades, so short terms are
+# filtered in Python instead of through the indexed ILIKE query
+MIN_INDEXED_SEARCH_LENGTH = 3
+# Categories have no mutation endpoints, so a short TTL is enough to
+# keep the cache honest against out-of-band changes
+CATEGORIES_CACHE_TIMEOUT = 300
+QUESTION_FIELDS = ('question', 'answer', 'category', 'difficulty')
+# Caps on client-supplied values so pathological input turns into a
+# cheap 400 or clamp instead of an expensive query or a 500
+MAX_PAGE = 10_000
+MAX_PREVIOUS_QUESTIONS = 1_000
+
+cache = Cache()
+
+
+def json_response(payload, status=200):
+    """
+    Serializes a payload with orjson, which writes JSON bytes directly
+    and is several times faster than the stdlib encoder behind jsonify
+    :param payload: JSON-serializable response payload
+    :param status: HTTP status code for the response
+    :return: HTTP Response with an application/json body
+    """
+    return current_app.response_class(
+        orjson.dumps(payload), status=status, mimetype='application/json')
+
+
+def _parse_page():
+    """
+    Reads the page query parameter, clamping bad or extreme values
+    :return: Page number between 1 and MAX_PAGE
+    """
+    try:
+        page = int(request.args.get('page', '1'))
+    except ValueError:
+        return 1
+    return min(max(page, 1), MAX_PAGE)
 
 
 def create_app():
@@ -17,22 +59,43 @@ def create_app():
     :return: Flask application
     """
     app = Flask(__name__)
+    # Sized for a threaded WSGI server; pre-ping and recycle guard
+    # against stale connections sitting in the pool
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': 20,
+        'max_overflow': 10,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'pool_use_lifo': True
+    }
     setup_db(app)
 
-    CORS(app, resources={r'/*': {'origins': '*'}})
+    redis_url = os.environ.get('REDIS_URL')
+    cache.init_app(app, config={
+        'CACHE_TYPE': 'redis',
+        'CACHE_REDIS_URL': redis_url
+    } if redis_url else {'CACHE_TYPE': 'simple'})
+
+    CORS(app, resources={r'/*': {
+        'origins': '*',
+        'send_wildcard': True,
+        'allow_headers': ['Content-Type', 'Authorization', 'true'],
+        'methods': ['GET', 'PATCH', 'POST', 'DELETE', 'OPTIONS']
+    }})
 
-    @app.after_request
-    def set_headers(response):
+    @cache.cached(timeout=CATEGORIES_CACHE_TIMEOUT, key_prefix='categories')
+    def _load_categories():
         """
-        Intercept response to add 'Access-Control-Allow' headers
-        :param response: HTTP Response
-        :return: Modified HTTP Response
+        Load all categories as an id -> type dictionary, cached since
+        categories change rarely
+        :return: Dictionary of category id to category type
         """
-        response.headers.add('Access-Control-Allow-Headers',
-                             'Content-Type, Authorization, true')
-        response.headers.add('Access-Control-Allow-Methods',
-                             'GET, PATCH, POST, DELETE, OPTIONS')
-        return response
+        # Aggregated in Postgres so no Category objects are hydrated
+        # and no dict is assembled in Python; JSON keys are strings
+        # either way once serialized
+        return db.session.execute(text(
+            "SELECT COALESCE(jsonb_object_agg(id::text, type), '{}'::jsonb) "
+            'FROM categories')).scalar()
 
     @app.route('/categories', methods=['GET'])
     def get_all_categories():
@@ -40,11 +103,8 @@ def create_app():
         Creates a dictionary of all categories
         :return: All categories
         """
-        categories = {}
-        for category in Category.query.all():
-            categories[category.id] = category.type
-        return jsonify({
-            'categories': categories
+        return json_response({
+            'categories': _load_categories()
         })
 
     @app.route('/questions', methods=['GET'])
@@ -53,17 +113,23 @@ def create_app():
         Get all questions, categories and total questions from database
         :return: Questions, categories and total questions
         """
-        categories = {}
-        for category in Category.query.all():
-            categories[category.id] = category.type
-        questions = [question.format() for question in Question.query.all()]
-        page = int(request.args.get('page', '0'))
-        upper_limit = page * 10
-        lower_limit = upper_limit - 10
-        return jsonify({
-            'questions': questions[
-                         lower_limit:upper_limit] if page else questions,
-            'total_questions': len(questions),
+        page = _parse_page()
+        # Page, total and categories aggregated in one statement so the
+        # endpoint costs a single round-trip to the database
+        questions, total_questions, categories = db.session.execute(text(
+            'WITH c AS (SELECT COALESCE(jsonb_object_agg(id::text, type), '
+            "'{}'::jsonb) AS j FROM categories), "
+            "q AS (SELECT COALESCE(jsonb_agg(payload ORDER BY id), "
+            "'[]'::jsonb) AS j FROM (SELECT id, payload FROM questions "
+            'ORDER BY id LIMIT :page_size OFFSET :page_start) s), '
+            'n AS (SELECT count(*) AS total FROM questions) '
+            'SELECT q.j, n.total, c.j FROM c, q, n'), {
+                'page_size': QUESTIONS_PER_PAGE,
+                'page_start': (page - 1) * QUESTIONS_PER_PAGE
+            }).first()
+        return json_response({
+            'questions': questions,
+            'total_questions': total_questions,
             'categories': categories
         })
 
@@ -74,12 +140,15 @@ def create_app():
         :param question_id: Id of the question to be deleted
         :return: Id of the question that has been deleted
         """
-        question = Question.query.get(question_id)
-        if not question:
+        deleted = db.session.execute(
+            Question.__table__.delete()
+            .where(Question.id == question_id)
+            .returning(Question.id)).first()
+        if not deleted:
             return abort(404, f'No question found with id: {question_id}')
-        question.delete()
-        return jsonify({
-            'deleted': question_id
+        db.session.commit()
+        return json_response({
+            'deleted': deleted[0]
         })
 
     @app.route('/questions', methods=['POST'])
@@ -88,17 +157,15 @@ def create_app():
         Adds a question to database
         :return: The question that is added
         """
-        question = request.json.get('question')
-        answer = request.json.get('answer')
-        category = request.json.get('category')
-        difficulty = request.json.get('difficulty')
-        if not (question and answer and category and difficulty):
+        body = request.get_json(silent=True) or {}
+        if any(not body.get(field) for field in QUESTION_FIELDS):
             return abort(400,
                          'Required question object keys missing from request '
                          'body')
-        question_entry = Question(question, answer, category, difficulty)
+        question_entry = Question(*(body[field] for field in
+                                    QUESTION_FIELDS))
         question_entry.insert()
-        return jsonify({
+        return json_response({
             'question': question_entry.format()
         })
 
@@ -109,9 +176,28 @@ def create_app():
         :return: Searched questions and total questions
         """
         search_term = request.json.get('searchTerm', '')
-        questions = [question.format() for question in Question.query.all() if
-                     re.search(search_term, question.question, re.IGNORECASE)]
-        return jsonify({
+        if len(search_term) >= MIN_INDEXED_SEARCH_LENGTH:
+            escaped = search_term.replace('\\', '\\\\') \
+                .replace('%', '\\%').replace('_', '\\_')
+            questions = [payload for payload, in
+                         Question.query.with_entities(Question.payload)
+                         .filter(Question.question.ilike(f'%{escaped}%'))]
+        elif re.escape(search_term) == search_term:
+            # Plain text: a C-level substring check beats invoking the
+            # regex engine per row
+            needle = search_term.lower()
+            questions = [question.format() for question in
+                         Question.query.all() if
+                         needle in question.question.lower()]
+        else:
+            try:
+                pattern = re.compile(search_term, re.IGNORECASE)
+            except re.error:
+                return abort(400, 'Invalid search term')
+            questions = [question.format() for question in
+                         Question.query.all() if
+                         pattern.search(question.question)]
+        return json_response({
             'questions': questions,
             'total_questions': len(questions)
         })
@@ -125,11 +211,17 @@ def create_app():
         """
         if not category_id:
             return abort(400, 'Invalid category id')
-        questions = [question.format() for question in
-                     Question.query.filter(Question.category == category_id)]
-        return jsonify({
-            'questions': questions,
-            'total_questions': len(questions),
+        page = _parse_page()
+        base = Question.query.filter(Question.category == category_id)
+        total_questions = base.with_entities(
+            func.count(Question.id)).scalar()
+        questions = base.with_entities(Question.payload) \
+            .order_by(Question.id) \
+            .limit(QUESTIONS_PER_PAGE) \
+            .offset((page - 1) * QUESTIONS_PER_PAGE).all()
+        return json_response({
+            'questions': [payload for payload, in questions],
+            'total_questions': total_questions,
             'current_category': category_id
         })
 
@@ -139,19 +231,34 @@ def create_app():
         Gets question for quiz
         :return: Uniques quiz question or None
         """
-        previous_questions = request.json.get('previous_questions')
+        previous_questions = request.json.get('previous_questions') or []
         quiz_category = request.json.get('quiz_category')
         if not quiz_category:
             return abort(400, 'Required keys missing from request body')
-        category_id = int(quiz_category.get('id'))
+        if not isinstance(previous_questions, list) or \
+                len(previous_questions) > MAX_PREVIOUS_QUESTIONS:
+            return abort(400, 'previous_questions must be a list of at most '
+                              f'{MAX_PREVIOUS_QUESTIONS} question ids')
+        try:
+            previous_questions = [int(question_id) for question_id in
+                                  previous_questions]
+            category_id = int(quiz_category.get('id'))
+        except (TypeError, ValueError):
+            return abort(400, 'Question and category ids must be integers')
+        # A bound array keeps the statement text stable however many
+        # questions have been seen, so Postgres can reuse the plan
+        not_seen = Question.id != all_(
+            bindparam('previous_questions', type_=ARRAY(Integer)))
         questions = Question.query.filter(
             Question.category == category_id,
-            ~Question.id.in_(previous_questions)) if category_id else \
-            Question.query.filter(~Question.id.in_(previous_questions))
-        question = questions.order_by(func.random()).first()
-        if not question:
-            return jsonify({})
-        return jsonify({
+            not_seen) if category_id else Question.query.filter(not_seen)
+        questions = questions.params(
+            previous_questions=previous_questions)
+        remaining = questions.count()
+        if not remaining:
+            return json_response({})
+        question = questions.offset(random.randrange(remaining)).first()
+        return json_response({
             'question': question.format()
         })
 
@@ -163,11 +270,11 @@ def create_app():
         :param error: HTTPException containing code and description
         :return: error: HTTP status code, message: Error description
         """
-        return jsonify({
+        return json_response({
             'success': False,
             'error': error.code,
             'message': error.description
-        }), error.code
+        }, error.code)
 
     @app.errorhandler(Exception)
     def exception_handler(error):
@@ -176,10 +283,14 @@ def create_app():
         :param error: Any exception
         :return: error: HTTP status code, message: Error description
         """
-        return jsonify({
+        # The details go to the log; formatting them into the response
+        # costs an allocation per error and leaks internals to clients
+        app.logger.exception('Unhandled exception')
+        return json_response({
             'success': False,
             'error': 500,
-            'message': f'Something went wrong: {error}'
-        }), 500
+            'message': f'Something went wrong: {error}' if app.debug
+                       else 'Internal server error'
+        }, 500)
 
     return app
@@ -1,24 +1,23 @@
 import unittest
 
 from flask import json
-from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
-from backend.database.models import setup_db
+from backend.database.models import db
 from backend.flaskr import create_app
 
 
 class TriviaTestCase(unittest.TestCase):
     """This class represents the trivia test case"""
 
-    def setUp(self):
-        """Define test variables and initialize app."""
-        self.app = create_app()
-        self.client = self.app.test_client
-        self.database_name = 'trivia'
-        self.database_path = \
-            f'postgresql://localhost:5432/{self.database_name}'
-        setup_db(self.app, self.database_path)
+    @classmethod
+    def setUpClass(cls):
+        """Create the app, engine and schema once for all tests"""
+        cls.app = create_app()
+        cls.client = cls.app.test_client
 
+    def setUp(self):
+        """Define test variables and open a throwaway transaction."""
         self.sample_question = {
             'question': 'Who invented the personal computer?',
             'answer': 'Steve Wozniak',
@@ -26,16 +25,20 @@ class TriviaTestCase(unittest.TestCase):
             'difficulty': 2
         }
 
-        # Binds the app to the current context
-        with self.app.app_context():
-            self.db = SQLAlchemy()
-            self.db.init_app(self.app)
-
-            self.db.create_all()
+        # Run the test's session inside an external transaction so
+        # commits made by endpoints never reach the database for real
+        self.connection = db.engine.connect()
+        self.trans = self.connection.begin()
+        self._original_session = db.session
+        db.session = db.create_scoped_session(
+            options={'bind': self.connection, 'binds': {}})
 
     def tearDown(self):
-        """Executed after reach test"""
-        pass
+        """Roll back everything the test wrote"""
+        db.session.remove()
+        db.session = self._original_session
+        self.trans.rollback()
+        self.connection.close()
 
     def test_get_all_categories(self):
         res = self.client().get('/categories')
@@ -43,6 +46,20 @@ class TriviaTestCase(unittest.TestCase):
         self.assertEqual(res.status_code, 200)
         self.assertIsInstance(data['categories'], dict)
 
+    def test_cors_preflight_headers(self):
+        res = self.client().options('/questions', headers={
+            'Origin': 'http://localhost:3000',
+            'Access-Control-Request-Method': 'GET',
+            'Access-Control-Request-Headers': 'Content-Type, Authorization'
+        })
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.headers.get('Access-Control-Allow-Origin'), '*')
+        self.assertIn('Authorization',
+                      res.headers.get('Access-Control-Allow-Headers', ''))
+        allowed_methods = res.headers.get('Access-Control-Allow-Methods', '')
+        for method in ('GET', 'PATCH', 'POST', 'DELETE', 'OPTIONS'):
+            self.assertIn(method, allowed_methods)
+
     def test_get_questions(self):
         res = self.client().get('/questions?page=1')
         data = json.loads(res.data)
@@ -52,6 +69,24 @@ class TriviaTestCase(unittest.TestCase):
         self.assertIsInstance(data['total_questions'], int)
         self.assertIsInstance(data['categories'], dict)
 
+    def test_get_questions_query_count(self):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context,
+                   executemany):
+            statements.append(statement)
+
+        event.listen(db.engine, 'before_cursor_execute', record)
+        try:
+            res = self.client().get('/questions?page=1')
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', record)
+        self.assertEqual(res.status_code, 200)
+        # The endpoint fetches page, total and categories in one CTE
+        # statement - anything more means a second round-trip or a
+        # per-row lazy load has crept in
+        self.assertLessEqual(len(statements), 1)
+
     def test_delete_question(self):
         question_id = 1
         res = self.client().delete(f'/questions/{question_id}')